@@ -1,159 +1,188 @@
+import asyncio
 import datetime
 import logging.config
 from environs import Env
 from seller import download_stock
 
+import pandas as pd
 import requests
 
-from seller import divide, price_conversion
+from seller import (
+    classify_counts,
+    divide,
+    make_session,
+    price_conversion,
+    send_batches,
+)
 
 logger = logging.getLogger(__file__)
 
+SESSION = make_session()
 
-def get_product_list(page, campaign_id, access_token):
+
+def configure_session(access_token):
+    """Сохраняет токен Яндекс Маркета в заголовках сессии SESSION.
+
+    Args:
+        access_token (str): Токен доступа партнёра.
+
+    Пример:
+        >>> configure_session("token")
+        >>> SESSION.headers["Authorization"]
+        'Bearer token'
+
+    Некорректный пример:
+        >>> configure_session("")  # пустой токен
+        >>> get_product_list("", "123")
+        Traceback (most recent call last):
+        ...
+        requests.exceptions.HTTPError
+    """
+    SESSION.headers.update(
+        {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {access_token}",
+            "Accept": "application/json",
+        }
+    )
+
+
+def get_product_list(page, campaign_id):
     """Получает список товаров из Яндекс Маркета.
 
     Args:
         page (str): Номер страницы.
         campaign_id (str): ID кампании магазина.
-        access_token (str): Токен доступа партнёра.
 
     Returns:
         dict: Словарь с результатами, который вернул API Яндекса.
 
     Пример:
-        >>> data = get_product_list("", "123", "token")
+        >>> data = get_product_list("", "123")
         >>> isinstance(data, dict)
         True
 
     Некорректный пример:
-        >>> get_product_list(None, "", "")
+        >>> get_product_list(None, "")
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {
         "page_token": page,
         "limit": 200,
     }
     url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
+    response = SESSION.get(url, params=payload)
     response.raise_for_status()
     response_object = response.json()
     return response_object.get("result")
 
 
-def update_stocks(stocks, campaign_id, access_token):
+def update_stocks(stocks, campaign_id):
     """Отправляет остатки товаров в Яндекс Маркет.
 
     Args:
         stocks (list): Список остатков в формате API Яндекса.
         campaign_id (str): ID кампании магазина.
-        access_token (str): Токен доступа партнёра.
 
     Returns:
         dict: Ответ API Яндекса.
 
     Пример:
-        >>> update_stocks([{"sku": "123", "items": [{"count": 5}]}], "123", "token")
+        >>> update_stocks([{"sku": "123", "items": [{"count": 5}]}], "123")
         {'result': ...}
 
     Некорректный пример:
-        >>> update_stocks([], "123", "token")
+        >>> update_stocks([], "123")
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {"skus": stocks}
     url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
+    response = SESSION.put(url, json=payload)
     response.raise_for_status()
     response_object = response.json()
     return response_object
 
 
-def update_price(prices, campaign_id, access_token):
+def update_price(prices, campaign_id):
     """Отправляет новые цены в Яндекс Маркет.
 
     Args:
         prices (list): Список цен в формате API Яндекса.
         campaign_id (str): ID кампании магазина.
-        access_token (str): Токен доступа партнёра.
 
     Returns:
         dict: Ответ API Яндекса.
 
     Пример:
-        >>> update_price([{"id": "100", "price": {"value": 5000}}], "123", "token")
+        >>> update_price([{"id": "100", "price": {"value": 5000}}], "123")
         {'result': ...}
 
     Некорректный пример:
-        >>> update_price([], "123", "token")
+        >>> update_price([], "123")
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {"offers": prices}
     url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
+    response = SESSION.post(url, json=payload)
     response.raise_for_status()
     response_object = response.json()
     return response_object
 
 
-def get_offer_ids(campaign_id, market_token):
+async def get_offer_ids(campaign_id):
     """Получить артикулы товаров Яндекс маркета
 
+    Следующая страница запрашивается сразу, как только известен её токен,
+    и загружается, пока разбирается текущая.
+
     Args:
         campaign_id (str): ID кампании магазина.
-        market_token (str): Токен доступа партнёра.
 
     Returns:
         list: Список артикулов товаров.
 
     Пример:
-        >>> ids = get_offer_ids("123", "token")
+        >>> ids = await get_offer_ids("123")
         >>> isinstance(ids, list)
         True
 
     Некорректный пример:
-        >>> get_offer_ids("", "")
+        >>> await get_offer_ids("")
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
-    page = ""
-    product_list = []
+    offer_ids = []
+    some_prod = await asyncio.to_thread(get_product_list, "", campaign_id)
     while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
-        if not page:
+        page = some_prod["paging"].get("nextPageToken")
+        next_page = None
+        if page:
+            next_page = asyncio.create_task(
+                asyncio.to_thread(get_product_list, page, campaign_id)
+            )
+        try:
+            offer_ids.extend(
+                product["offer"]["shopSku"]
+                for product in some_prod["offerMappingEntries"]
+            )
+        except Exception:
+            # Не оставлять без ожидания уже запрошенную следующую страницу
+            if next_page is not None:
+                next_page.cancel()
+            raise
+        if next_page is None:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
+        some_prod = await next_page
     return offer_ids
 
 
@@ -161,70 +190,65 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
     """Создаёт список остатков для Яндекс Маркета.
 
     Args:
-        watch_remnants (list): Список остатков Casio.
+        watch_remnants (pandas.DataFrame | list): Список остатков Casio.
         offer_ids (list): Артикулы товаров из Маркета.
         warehouse_id (str): ID склада.
 
     Returns:
-        list: Список остатков для отправки в API.
+        tuple: (все остатки для отправки в API, остатки с ненулевым количеством)
 
     Пример:
-        >>> create_stocks([{"Код": "100", "Количество": "5"}], ["100"], "wh1")
+        >>> remnants = [{"Код": "100", "Количество": "5"}]
+        >>> stocks, not_empty = create_stocks(remnants, ["100"], "wh1")
+        >>> stocks
         [{'sku': '100', 'warehouseId': 'wh1', 'items': [{'count': 5, 'type': 'FIT', ...}]}]
+        >>> stocks == not_empty
+        True
 
     Некорректный пример:
         >>> create_stocks([], ["100"], "wh1")
-        [{'sku': '100', 'warehouseId': 'wh1', 'items': [{'count': 0, ...}]}]
+        ([{'sku': '100', 'warehouseId': 'wh1', 'items': [{'count': 0, ...}]}], [])
     """
-    # Уберем то, что не загружено в market
-    stocks = list()
+    remnants = pd.DataFrame(watch_remnants, columns=["Код", "Количество"])
+    codes = remnants["Код"].astype(str)
+    # Уберем то, что не загружено в market, и повторы кодов
+    matched = codes.isin(set(offer_ids)) & ~codes.duplicated()
+    counts = classify_counts(remnants.loc[matched, "Количество"])
     date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
+
+    def stock_entry(sku, count):
+        return {
+            "sku": sku,
+            "warehouseId": warehouse_id,
+            "items": [
                 {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
+                    "count": count,
+                    "type": "FIT",
+                    "updatedAt": date,
                 }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+            ],
+        }
+
+    stocks = []
+    not_empty = []
+    for code, count in zip(codes[matched], counts):
+        stock = stock_entry(code, count)
+        stocks.append(stock)
+        if count != 0:
+            not_empty.append(stock)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
-    return stocks
+    found = set(codes[matched])
+    stocks.extend(
+        stock_entry(offer_id, 0) for offer_id in offer_ids if offer_id not in found
+    )
+    return stocks, not_empty
 
 
 def create_prices(watch_remnants, offer_ids):
     """Создаёт список цен для отправки в Яндекс Маркет.
 
     Args:
-        watch_remnants (list): Товары Casio.
+        watch_remnants (pandas.DataFrame | list): Товары Casio.
         offer_ids (list): Артикулы товаров из Маркета.
 
     Returns:
@@ -238,106 +262,133 @@ def create_prices(watch_remnants, offer_ids):
         >>> create_prices([], ["100"])
         []
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    remnants = pd.DataFrame(watch_remnants, columns=["Код", "Цена"])
+    codes = remnants["Код"].astype(str)
+    matched = codes.isin(set(offer_ids))
+    values = remnants.loc[matched, "Цена"].map(price_conversion).astype(int)
+    prices = [
+        {
+            "id": code,
+            # "feed": {"id": 0},
+            "price": {
+                "value": value,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for code, value in zip(codes[matched], values.tolist())
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+async def upload_prices(watch_remnants, campaign_id, offer_ids=None):
     """Обновляет цены товаров на Яндекс Маркете.
 
     Args:
-        watch_remnants (list): Товары Casio.
+        watch_remnants (pandas.DataFrame | list): Товары Casio.
         campaign_id (str): ID кампании.
-        market_token (str): Токен доступа партнёра.
+        offer_ids (list, optional): Артикулы товаров из Маркета.
+            Если не переданы, запрашиваются через get_offer_ids.
 
     Returns:
         list: Список отправленных цен.
 
     Пример:
-        >>> # await upload_prices([...], "123", "token")
+        >>> # await upload_prices([...], "123")
 
     Некорректный пример:
-        >>> await upload_prices([], "123", "token")
+        >>> await upload_prices([], "123")
         []
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = await get_offer_ids(campaign_id)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    await send_batches(update_price, divide(prices, 500), campaign_id)
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(watch_remnants, campaign_id, warehouse_id, offer_ids=None):
     """Обновляет остатки товаров на Яндекс Маркете.
 
     Args:
-        watch_remnants (list): Остатки Casio.
+        watch_remnants (pandas.DataFrame | list): Остатки Casio.
         campaign_id (str): ID кампании магазина.
-        market_token (str): Токен доступа.
         warehouse_id (str): ID склада.
+        offer_ids (list, optional): Артикулы товаров из Маркета.
+            Если не переданы, запрашиваются через get_offer_ids.
 
     Returns:
         tuple: (товары с ненулевыми остатками, все товары)
 
     Пример:
-        >>> # await upload_stocks([...], "123", "token", "wh1")
+        >>> # await upload_stocks([...], "123", "wh1")
 
     Некорректный пример:
-        >>> await upload_stocks([], "123", "token", "wh1")
+        >>> await upload_stocks([], "123", "wh1")
         ([], [])
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
-    )
+    if offer_ids is None:
+        offer_ids = await get_offer_ids(campaign_id)
+    stocks, not_empty = create_stocks(watch_remnants, offer_ids, warehouse_id)
+    await send_batches(update_stocks, divide(stocks, 2000), campaign_id)
     return not_empty, stocks
 
 
-def main():
+async def update_campaign(watch_remnants, campaign_id, warehouse_id, offer_ids=None):
+    """Обновляет остатки и цены одной кампании Яндекс Маркета.
+
+    Args:
+        watch_remnants (pandas.DataFrame | list): Остатки Casio.
+        campaign_id (str): ID кампании магазина.
+        warehouse_id (str): ID склада кампании.
+        offer_ids (list, optional): Артикулы товаров кампании.
+            Если не переданы, запрашиваются через get_offer_ids.
+
+    Пример:
+        >>> # await update_campaign([...], "123", "wh1")
+
+    Некорректный пример:
+        >>> await update_campaign([], "", "wh1")
+        Traceback (most recent call last):
+        ...
+        requests.exceptions.HTTPError
+    """
+    if offer_ids is None:
+        offer_ids = await get_offer_ids(campaign_id)
+    # Обновить остатки и поменять цены
+    await asyncio.gather(
+        upload_stocks(watch_remnants, campaign_id, warehouse_id, offer_ids),
+        upload_prices(watch_remnants, campaign_id, offer_ids),
+    )
+
+
+async def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
     campaign_fbs_id = env.str("FBS_ID")
     campaign_dbs_id = env.str("DBS_ID")
     warehouse_fbs_id = env.str("WAREHOUSE_FBS_ID")
     warehouse_dbs_id = env.str("WAREHOUSE_DBS_ID")
+    configure_session(market_token)
 
-    watch_remnants = download_stock()
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
+        watch_remnants, fbs_offer_ids, dbs_offer_ids = await asyncio.gather(
+            asyncio.to_thread(download_stock),
+            get_offer_ids(campaign_fbs_id),
+            get_offer_ids(campaign_dbs_id),
+        )
+        # FBS и DBS обновляются одновременно
+        await asyncio.gather(
+            update_campaign(
+                watch_remnants, campaign_fbs_id, warehouse_fbs_id, fbs_offer_ids
+            ),
+            update_campaign(
+                watch_remnants, campaign_dbs_id, warehouse_dbs_id, dbs_offer_ids
+            ),
+        )
     except requests.exceptions.ReadTimeout:
         print("Превышено время ожидания...")
     except requests.exceptions.ConnectionError as error:
@@ -347,4 +398,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
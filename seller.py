@@ -1,43 +1,125 @@
-import io
+import asyncio
+import hashlib
+import json
 import logging.config
 import os
 import re
+import tempfile
 import zipfile
 from environs import Env
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__file__)
 
+# Сколько запросов к одному API маркетплейса может выполняться одновременно.
+# Ограничение общее для всех вызовов: его держит пул соединений make_session
+MAX_CONCURRENT_REQUESTS = 8
+NOT_DIGITS = re.compile("[^0-9]")
+# Здесь хранится последняя разобранная таблица остатков Casio
+STOCK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "seller-apis")
 
-def get_product_list(last_id, client_id, seller_token):
-    """Получить список товаров из Ozon API.
+
+def make_session():
+    """Создать сессию для запросов к API маркетплейса.
+
+    Соединения сессии хранятся в пуле и переиспользуются между запросами,
+    а временные ошибки API (429 и 5xx) повторяются с паузой.
+
+    Returns:
+        requests.Session: Сессия без заголовков авторизации.
+
+    Пример:
+        >>> session = make_session()
+        >>> isinstance(session, requests.Session)
+        True
+
+    Некорректный пример:
+        >>> url = "https://api-seller.ozon.ru/v2/product/list"
+        >>> make_session().post(url).raise_for_status()  # без ключей
+        Traceback (most recent call last):
+        ...
+        requests.exceptions.HTTPError
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST", "PUT"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    # С одним хостом открыто не больше MAX_CONCURRENT_REQUESTS соединений:
+    # остальные запросы ждут, пока соединение в пуле освободится
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=MAX_CONCURRENT_REQUESTS,
+            pool_block=True,
+            max_retries=retry,
+        ),
+    )
+    return session
+
+
+SESSION = make_session()
+
+
+def configure_session(client_id, seller_token):
+    """Сохранить ключи Ozon в заголовках сессии SESSION.
 
     Args:
-        last_id (str): ID последнего товара.
         client_id (str): Идентификатор клиента Ozon.
         seller_token (str): Токен продавца Ozon.
 
+    Пример:
+        >>> configure_session("123", "token")
+        >>> SESSION.headers["Client-Id"]
+        '123'
+
+    Некорректный пример:
+        >>> configure_session("", "")  # пустые ключи
+        >>> get_product_list("")
+        Traceback (most recent call last):
+        ...
+        requests.exceptions.HTTPError
+    """
+    SESSION.headers.update(
+        {
+            "Client-Id": client_id,
+            "Api-Key": seller_token,
+        }
+    )
+
+
+def get_product_list(last_id):
+    """Получить список товаров из Ozon API.
+
+    Перед вызовом ключи должны быть сохранены через configure_session.
+
+    Args:
+        last_id (str): ID последнего товара.
+
     Returns:
         dict: Данные о товарах, которые вернул Ozon. Должен содержать items, total, last_id.
 
     Пример:
-        >>> data = get_product_list("", "123", "token")
+        >>> data = get_product_list("")
         >>> isinstance(data, dict)
         True
 
     Некорректный пример:
-        >>> get_product_list(None, None, None)  # отсутствуют реальные параметры
+        >>> get_product_list(None)  # сессия не настроена
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
     url = "https://api-seller.ozon.ru/v2/product/list"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
     payload = {
         "filter": {
             "visibility": "ALL",
@@ -45,121 +127,184 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = SESSION.post(url, json=payload)
     response.raise_for_status()
     response_object = response.json()
     return response_object.get("result")
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids():
     """Получить список артикулов товаров Ozon (offer_id).
 
-    Args:
-        client_id (str): Идентификатор клиента Ozon.
-        seller_token (str): Токен продавца Ozon.
+    Следующая страница запрашивается сразу, как только известен её last_id,
+    и загружается, пока разбирается текущая.
 
     Returns:
         list: Список товаров offer_id.
 
     Пример:
-        >>> ids = get_offer_ids("123", "token")
+        >>> ids = await get_offer_ids()
         >>> isinstance(ids, list)
         True
 
     Некорректный пример:
-        >>> get_offer_ids("", "")  # пустые ключи
+        >>> await get_offer_ids()  # пустые ключи в сессии
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
-    last_id = ""
-    product_list = []
+    offer_ids = []
+    some_prod = await asyncio.to_thread(get_product_list, "")
     while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
-        if total == len(product_list):
+        items = some_prod["items"]
+        total = some_prod["total"]
+        last_id = some_prod["last_id"]
+        next_page = None
+        if total != len(offer_ids) + len(items):
+            next_page = asyncio.create_task(
+                asyncio.to_thread(get_product_list, last_id)
+            )
+        try:
+            offer_ids.extend(product["offer_id"] for product in items)
+        except Exception:
+            # Не оставлять без ожидания уже запрошенную следующую страницу
+            if next_page is not None:
+                next_page.cancel()
+            raise
+        if next_page is None:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
+        some_prod = await next_page
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+def update_price(prices: list):
     """Отправить новые цены на товары в Ozon.
 
     Args:
         prices (list): Список цен для обновления в формате API Ozon.
-        client_id (str): Идентификатор клиента Ozon.
-        seller_token (str): Токен продавца Ozon.
 
     Returns:
         dict: Ответ от Ozon API.
 
     Пример:
-        >>> update_price([{"offer_id": "123", "price": "5000"}], "123", "token")
+        >>> update_price([{"offer_id": "123", "price": "5000"}])
         {'result': ...}
 
     Некорректный пример:
-        >>> update_price([], "123", "token")  # пустой список цен
+        >>> update_price([])  # пустой список цен
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
     url = "https://api-seller.ozon.ru/v1/product/import/prices"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
+    response = SESSION.post(url, json=payload)
     response.raise_for_status()
     return response.json()
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+def update_stocks(stocks: list):
     """Отправить количество товаров (остатки) в Ozon.
 
     Args:
         stocks (list): Список остатков вида {"offer_id": "...", "stock": число}.
-        client_id (str): Идентификатор клиента Ozon.
-        seller_token (str): Токен продавца Ozon.
 
     Returns:
         dict: Ответ от Ozon API.
 
     Пример:
-        >>> update_stocks([{"offer_id": "123", "stock": 5}], "123", "token")
+        >>> update_stocks([{"offer_id": "123", "stock": 5}])
         {'result': ...}
 
     Некорректный пример:
-        >>> update_stocks([], "123", "token")  # пустой список остатков
+        >>> update_stocks([])  # пустой список остатков
         Traceback (most recent call last):
         ...
         requests.exceptions.HTTPError
     """
     url = "https://api-seller.ozon.ru/v1/product/import/stocks"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
+    response = SESSION.post(url, json=payload)
     response.raise_for_status()
     return response.json()
 
 
+def load_stock_cache():
+    """Прочитать таблицу остатков, сохранённую прошлым запуском.
+
+    Returns:
+        pandas.DataFrame | None: Таблица из STOCK_CACHE_DIR или None, если
+            кэша нет или его не удалось прочитать.
+
+    Пример:
+        >>> cached = load_stock_cache()
+        >>> cached is None or isinstance(cached, pd.DataFrame)
+        True
+
+    Некорректный пример:
+        >>> load_stock_cache() is None  # файл кэша поврежден
+        True
+    """
+    try:
+        return pd.read_pickle(os.path.join(STOCK_CACHE_DIR, "ostatki.pkl"))
+    except Exception:
+        return None
+
+
+def save_stock_cache(meta, watch_remnants=None):
+    """Сохранить таблицу остатков и сведения об архиве в STOCK_CACHE_DIR.
+
+    Файлы пишутся рядом во временные и подменяются целиком через os.replace:
+    сначала таблица, затем сведения об архиве. Параллельный запуск другого
+    скрипта не увидит наполовину записанный кэш.
+
+    Args:
+        meta (dict): Хэш, ETag и Last-Modified скачанного архива.
+        watch_remnants (pandas.DataFrame, optional): Новая таблица остатков.
+            Если не передана, обновляются только сведения об архиве.
+
+    Пример:
+        >>> save_stock_cache({"sha256": "...", "etag": None}, pd.DataFrame())
+
+    Некорректный пример:
+        >>> save_stock_cache({"sha256": object()})
+        Traceback (most recent call last):
+        ...
+        TypeError
+    """
+    if watch_remnants is not None:
+        fd, tmp_path = tempfile.mkstemp(dir=STOCK_CACHE_DIR, suffix=".pkl")
+        os.close(fd)
+        try:
+            watch_remnants.to_pickle(tmp_path)
+            os.replace(tmp_path, os.path.join(STOCK_CACHE_DIR, "ostatki.pkl"))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    fd, tmp_path = tempfile.mkstemp(dir=STOCK_CACHE_DIR, suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, os.path.join(STOCK_CACHE_DIR, "ostatki.json"))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def download_stock():
-    """Скачать и распаковать файл остатков Casio, вернуть список товаров.
+    """Скачать и распаковать файл остатков Casio, вернуть таблицу товаров.
+
+    Разобранная таблица сохраняется в STOCK_CACHE_DIR вместе с ETag и
+    Last-Modified архива. Если сайт отвечает 304 Not Modified, архив не
+    скачивается; если скачанный архив не изменился, Excel не читается.
+    Поврежденный кэш не используется: архив скачивается и разбирается заново.
 
     Returns:
-        list: Список с остатками товаров из Excel.
+        pandas.DataFrame: Таблица с остатками товаров из Excel.
 
     Пример:
         >>> data = download_stock()
-        >>> isinstance(data, list)
+        >>> isinstance(data, pd.DataFrame)
         True
 
     Некорректный пример:
@@ -170,20 +315,56 @@ def download_stock():
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
-    response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    os.makedirs(STOCK_CACHE_DIR, exist_ok=True)
+    meta_path = os.path.join(STOCK_CACHE_DIR, "ostatki.json")
+    try:
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        meta = {}
+    cached = load_stock_cache() if meta.get("sha256") else None
+    # Ключи Ozon не должны уходить на сайт поставщика
+    headers = {"Client-Id": None, "Api-Key": None}
+    # Условный запрос только при целом кэше: на 304 нужна готовая таблица
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive_path = os.path.join(tmpdir, "ostatki.zip")
+        digest = hashlib.sha256()
+        with SESSION.get(casio_url, headers=headers, stream=True) as response:
+            # Архив не менялся с прошлого скачивания
+            if response.status_code == 304:
+                return cached
+            response.raise_for_status()
+            with open(archive_path, "wb") as archive_file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    archive_file.write(chunk)
+                    digest.update(chunk)
+        new_meta = {
+            "sha256": digest.hexdigest(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        watch_remnants = None
+        # Файл не изменился — берем уже разобранную таблицу
+        if new_meta["sha256"] == meta.get("sha256"):
+            watch_remnants = cached
+        if watch_remnants is None:
+            with zipfile.ZipFile(archive_path) as archive:
+                archive.extractall(tmpdir)
+            # Создаем список остатков часов:
+            watch_remnants = pd.read_excel(
+                io=os.path.join(tmpdir, "ostatki.xls"),
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            )
+            save_stock_cache(new_meta, watch_remnants)
+        else:
+            save_stock_cache(new_meta)
     return watch_remnants
 
 
@@ -191,44 +372,48 @@ def create_stocks(watch_remnants, offer_ids):
     """Создать список остатков для API Ozon на основе данных Casio.
 
         Args:
-            watch_remnants (list): Список товаров Casio.
+            watch_remnants (pandas.DataFrame | list): Список товаров Casio.
             offer_ids (list): Список offer_id из Ozon.
 
         Returns:
-            list: Список словарей вида {"offer_id": str, "stock": int}.
+            tuple: (все остатки, остатки не с нулевым количеством) —
+                списки словарей вида {"offer_id": str, "stock": int}.
 
         Пример:
             >>> create_stocks([{"Код": "100", "Количество": "5"}], ["100"])
-            [{'offer_id': '100', 'stock': 5}]
+            ([{'offer_id': '100', 'stock': 5}], [{'offer_id': '100', 'stock': 5}])
 
         Некорректный пример:
             >>> create_stocks([], ["100"])
-            [{'offer_id': '100', 'stock': 0}]
+            ([{'offer_id': '100', 'stock': 0}], [])
     """
-    # Уберем то, что не загружено в seller
+    remnants = pd.DataFrame(watch_remnants, columns=["Код", "Количество"])
+    codes = remnants["Код"].astype(str)
+    # Уберем то, что не загружено в seller, и повторы кодов
+    matched = codes.isin(set(offer_ids)) & ~codes.duplicated()
+    counts = classify_counts(remnants.loc[matched, "Количество"])
     stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    not_empty = []
+    for code, count in zip(codes[matched], counts):
+        stock = {"offer_id": code, "stock": count}
+        stocks.append(stock)
+        if count != 0:
+            not_empty.append(stock)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append({"offer_id": offer_id, "stock": 0})
-    return stocks
+    found = set(codes[matched])
+    stocks.extend(
+        {"offer_id": offer_id, "stock": 0}
+        for offer_id in offer_ids
+        if offer_id not in found
+    )
+    return stocks, not_empty
 
 
 def create_prices(watch_remnants, offer_ids):
     """Создать список цен для API Ozon.
 
         Args:
-            watch_remnants (list): Товары Casio.
+            watch_remnants (pandas.DataFrame | list): Товары Casio.
             offer_ids (list): Список offer_id из Ozon.
 
         Returns:
@@ -242,17 +427,20 @@ def create_prices(watch_remnants, offer_ids):
             >>> create_prices([], ["100"])
             []
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    remnants = pd.DataFrame(watch_remnants, columns=["Код", "Цена"])
+    codes = remnants["Код"].astype(str)
+    matched = codes.isin(set(offer_ids))
+    converted = remnants.loc[matched, "Цена"].map(price_conversion)
+    prices = [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": code,
+            "old_price": "0",
+            "price": price,
+        }
+        for code, price in zip(codes[matched], converted)
+    ]
     return prices
 
 
@@ -273,7 +461,33 @@ def price_conversion(price: str) -> str:
         >>> price_conversion("цена неизвестна")
         ''
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return NOT_DIGITS.sub("", price.split(".", 1)[0])
+
+
+def classify_counts(counts):
+    """Перевести остатки Casio в количество товара для маркетплейса.
+
+    ">10" превращается в 100, "1" — в 0, остальные значения в целые числа.
+
+    Args:
+        counts (pandas.Series): Колонка "Количество" из файла остатков.
+
+    Returns:
+        list: Остатки в виде целых чисел.
+
+    Пример:
+        >>> classify_counts(pd.Series([">10", "1", "5", 0]))
+        [100, 0, 5, 0]
+
+    Некорректный пример:
+        >>> classify_counts(pd.Series(["нет"]))
+        Traceback (most recent call last):
+        ...
+        ValueError
+    """
+    counts = counts.astype(str)
+    counts = counts.mask(counts == ">10", "100").mask(counts == "1", "0")
+    return counts.astype(int).tolist()
 
 
 def divide(lst: list, n: int):
@@ -300,72 +514,105 @@ def divide(lst: list, n: int):
         yield lst[i : i + n]
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+async def send_batches(send, batches, *args):
+    """Отправить части списка в API параллельно.
+
+    Части забираются из batches по мере отправки: каждый вызов держит в
+    работе не больше MAX_CONCURRENT_REQUESTS частей, каждую в фоновом потоке.
+    Общий предел запросов к API задаёт пул соединений сессии, поэтому
+    несколько одновременных вызовов вместе его не превышают.
+
+    Args:
+        send (callable): Функция отправки одной части, например update_stocks.
+        batches (iterable): Части списка, например генератор divide.
+        *args: Дополнительные аргументы для send.
+
+    Returns:
+        list: Ответы API в порядке частей.
+
+    Пример:
+        >>> # await send_batches(update_stocks, divide(stocks, 100))
+
+    Некорректный пример:
+        >>> await send_batches(update_stocks, [])
+        []
+    """
+    batches = enumerate(batches)
+    responses = {}
+
+    async def worker():
+        for index, batch in batches:
+            responses[index] = await asyncio.to_thread(send, batch, *args)
+
+    await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENT_REQUESTS)))
+    return [responses[index] for index in sorted(responses)]
+
+
+async def upload_prices(watch_remnants, offer_ids=None):
     """Обновить цены товаров в Ozon.
 
         Args:
-            watch_remnants (list): Товары Casio.
-            client_id (str): Client-ID Ozon.
-            seller_token (str): API-ключ продавца.
+            watch_remnants (pandas.DataFrame | list): Товары Casio.
+            offer_ids (list, optional): Список offer_id из Ozon.
+                Если не передан, запрашивается через get_offer_ids.
 
         Returns:
             list: Список отправленных цен.
 
         Пример:
-            >>> # upload_prices([...], "123", "token")  # асинхронная функция
+            >>> # upload_prices([...])  # асинхронная функция
 
         Некорректный пример:
-            >>> await upload_prices([], "123", "token")
+            >>> await upload_prices([])
             []
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = await get_offer_ids()
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    await send_batches(update_price, divide(prices, 1000))
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(watch_remnants, offer_ids=None):
     """Обновить остатки товаров в Ozon.
 
         Args:
-            watch_remnants (list): Остатки Casio.
-            client_id (str): Client-ID Ozon.
-            seller_token (str): API-ключ продавца.
+            watch_remnants (pandas.DataFrame | list): Остатки Casio.
+            offer_ids (list, optional): Список offer_id из Ozon.
+                Если не передан, запрашивается через get_offer_ids.
 
         Returns:
             tuple: (товары не с нулевым остатком, все товары)
 
         Пример:
-            >>> # await upload_stocks([...], "123", "token")
+            >>> # await upload_stocks([...])
 
         Некорректный пример:
-            >>> await upload_stocks([], "123", "token")
+            >>> await upload_stocks([])
             ([], [])
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+    if offer_ids is None:
+        offer_ids = await get_offer_ids()
+    stocks, not_empty = create_stocks(watch_remnants, offer_ids)
+    await send_batches(update_stocks, divide(stocks, 100))
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
+    configure_session(client_id, seller_token)
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
-        watch_remnants = download_stock()
-        # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
-        # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
+        offer_ids, watch_remnants = await asyncio.gather(
+            get_offer_ids(),
+            asyncio.to_thread(download_stock),
+        )
+        # Обновить остатки и поменять цены
+        await asyncio.gather(
+            upload_stocks(watch_remnants, offer_ids),
+            upload_prices(watch_remnants, offer_ids),
+        )
     except requests.exceptions.ReadTimeout:
         print("Превышено время ожидания...")
     except requests.exceptions.ConnectionError as error:
@@ -375,4 +622,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())